@@ -3,85 +3,84 @@ import os
 import re, math
 from pathlib import Path
 from datetime import datetime
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 
 # ========= Paths / Naming =========
-INPUT_FILE   = "mapped_items.xlsx"
-OUTPUT_XLSX  = "processed_new_inventory_final.xlsx"   # optional xlsx (still produced)
+INPUT_FILE   = "mapped_items.parquet"   # written by mapItems.py (mapped_items.xlsx is the human-readable copy)
+OUTPUT_XLSX  = "processed_new_inventory_final.xlsx"   # optional audit xlsx, only written when SAVE_XLSX=1
+SAVE_XLSX = os.getenv("SAVE_XLSX", "0").strip().lower() in ("1", "true", "yes")  # off in production; the upload only needs the CSV
 OVERRIDE_DATE = None  # e.g., "20250828" to force a specific date; otherwise use today
 
+# ========= Dtypes =========
+# Arrow-backed strings: denser than object columns, and .str.* dispatches to pyarrow compute kernels
+_STR_DTYPE = "string[pyarrow]"
+_STR_COLS  = ("name", "code", "sku", "priceType")
+
 # ========= SFTP creds via env =========
 INSTACART_SFTP_PASSWORD = os.getenv("INSTACART_SFTP_PASSWORD")
 INSTACART_SFTP_USR = os.getenv("INSTACART_SFTP_USR")
 INSTACART_SFTP_HOST = os.getenv("INSTACART_SFTP_HOST")
 
 # ========= Regex helpers =========
-_INT_OR_WHOLE_FLOAT = re.compile(r'^\d+(?:\.0+)?$')  # "182" or "182.0" allowed
-
-def normalize_numeric_token(s):
-    if s is None:
-        return None
-    s = str(s).strip()
-    if not s:
-        return None
-    if s.isdigit():
-        return s
-    if _INT_OR_WHOLE_FLOAT.fullmatch(s):
-        return s.split('.', 1)[0]
-    return None
-
-def first_valid_numeric_from_list(s):
-    if s is None:
-        return None
-    for token in re.split(r'[;,]', str(s)):
-        norm = normalize_numeric_token(token)
-        if norm is not None:
-            return norm
-    return None
-
-# ========= Size / unit extraction =========
-def extract_size_and_unit(name):
-    if not isinstance(name, str):
-        return name, 1, "each"
-    words = name.strip().split()
-    if not words:
-        return name, 1, "each"
-    allowed = {"g","lb","gr","kg","pk","pack","each","oz","mg","ml","l"}
-    if words[-1].lower() == "each" and len(words) >= 2:
-        t = words[-2]
-        m = re.match(r'^(\d+(?:\.\d+)?)([A-Za-z]+)$', t)
-        if m:
-            try: num = float(m.group(1))
-            except ValueError: num = 1
-            unit = m.group(2).lower()
-            if unit in allowed:
-                return " ".join(words[:-2]), num, unit
-    t = words[-1]
-    m = re.match(r'^(\d+(?:\.\d+)?)([A-Za-z]+)$', t)
-    if m:
-        try: num = float(m.group(1))
-        except ValueError: num = 1
-        unit = m.group(2).lower()
-        if unit in allowed:
-            return " ".join(words[:-1]), num, unit
-    return name, 1, "each"
-
-# ========= Lookup-code selection =========
-def get_lookup_code(row, product_code_col: str, sku_col: str) -> str:
-    pc_raw = row[product_code_col] if pd.notna(row[product_code_col]) else ""
-    sku_raw = row[sku_col]         if pd.notna(row[sku_col])         else ""
-    pc_str, sku_str = str(pc_raw).strip(), str(sku_raw).strip()
-    pc = first_valid_numeric_from_list(pc_str) or normalize_numeric_token(pc_str) or ""
-    sk = first_valid_numeric_from_list(sku_str) or normalize_numeric_token(sku_str) or ""
-    try: pc_int = int(pc) if pc else None
-    except: pc_int = None
-    try: sk_int = int(sk) if sk else None
-    except: sk_int = None
-    if pc_int is not None and sk_int is not None:
-        return pc if pc_int >= sk_int else sk
-    if pc_int is not None: return pc
-    if sk_int is not None: return sk
-    return ""
+# Column-wise matching hands .pattern to arrow's RE2 kernels, so keep these RE2-compatible:
+# flags inline ("(?i)"), named groups for extraction, no lookarounds/backrefs.
+# Digits are spelled [0-9]: RE2's \d is ASCII-only while Python's is Unicode, and [0-9] means the same in both.
+_INT_OR_WHOLE_FLOAT = re.compile(r'^[0-9]+(?:\.0+)?$')  # "182" or "182.0" allowed
+_CASE_DOZEN_RE = re.compile(r'(?i)case|dozen')
+_FIRST_NUMERIC_TOKEN_RE = re.compile(r'(?:^|[;,])\s*(?P<num>[0-9]+)(?:\.0+)?\s*(?:[;,]|$)')
+# one pass for both "<name> 500g" and "<name> 500g each"; matched against whitespace-collapsed names
+_SIZE_RE = re.compile(r'(?i)^(?:(?P<name>.*) )?(?P<num>[0-9]+(?:\.[0-9]+)?)(?P<unit>g|lb|gr|kg|pk|pack|each|oz|mg|ml|l)(?: each)?$')
+
+# ========= Vectorized column helpers =========
+def regex_extract_series(s: pd.Series, pattern: re.Pattern) -> pd.DataFrame:
+    """Series.str.extract via arrow's RE2 extract_regex (pandas runs extract per row in Python)."""
+    res = pc.extract_regex(pa.array(s, type=pa.string(), from_pandas=True), pattern.pattern)
+    return pd.DataFrame(
+        {g: pd.Series(pc.struct_field(res, g), index=s.index, dtype=_STR_DTYPE) for g in pattern.groupindex},
+        index=s.index,
+    )
+
+def first_valid_numeric_series(s: pd.Series) -> pd.Series:
+    """First whole-number token of a ';'/','-separated code list ("182.0" → "182"), else <NA>."""
+    # Fast path: most codes are already a bare integer; only the remaining rows go through the token regex.
+    # ASCII [0-9] like the regexes (isdecimal would let other scripts' digits through to pick_lookup_code).
+    s = s.astype(_STR_DTYPE)
+    plain = s.str.fullmatch("[0-9]+").fillna(False).astype(bool)
+    out = s.where(plain)
+    rest = ~plain & s.notna()
+    if rest.any():
+        out = out.mask(rest, regex_extract_series(s[rest], _FIRST_NUMERIC_TOKEN_RE)["num"])
+    return out
+
+def pick_lookup_code(code_num: pd.Series, sku_num: pd.Series) -> pd.Series:
+    """Lookup code per row: the larger of code/sku (as ints), code on ties, "" when neither parsed."""
+    # Compare as integers without parsing: fewer significant digits is smaller, equal length compares lexically.
+    # Keeps leading zeros in the chosen code and never overflows on long barcodes.
+    code_key, sku_key = code_num.fillna("").str.lstrip("0"), sku_num.fillna("").str.lstrip("0")
+    code_len, sku_len = code_key.str.len(), sku_key.str.len()
+    code_ge = (code_len > sku_len) | ((code_len == sku_len) & (code_key >= sku_key))
+    code_wins = sku_num.isna() | (code_num.notna() & code_ge)
+    return code_num.where(code_wins, sku_num).fillna("")
+
+def collapse_whitespace_series(s: pd.Series) -> pd.Series:
+    """Column-wise " ".join(x.split()) in arrow compute (same Unicode whitespace set as str.split)."""
+    arr = pc.utf8_trim_whitespace(pa.array(s, type=pa.string(), from_pandas=True))
+    return pd.Series(pc.binary_join(pc.utf8_split_whitespace(arr), " "), index=s.index, dtype=_STR_DTYPE)
+
+def extract_size_and_unit_series(names: pd.Series) -> pd.DataFrame:
+    """Split a trailing size off names: "Rice 5lb each" → (Rice, 5.0, lb); no size → (name, 1, each)."""
+    words = collapse_whitespace_series(names)
+    ext = regex_extract_series(words, _SIZE_RE)
+    matched = ext["num"].notna()
+    return pd.DataFrame({
+        "name": ext["name"].fillna("").where(matched, names),
+        "size": pd.to_numeric(ext["num"], errors="coerce").fillna(1).astype(float),
+        "size_uom": ext["unit"].str.lower().fillna("each"),
+    }, index=names.index)
 
 # ========= Retail rounding helper =========
 def retail_round(x: float) -> float:
@@ -95,71 +94,99 @@ def retail_round(x: float) -> float:
             return round(base + c, 2)
     return round(base + 1 + 0.29, 2)
 
+_RETAIL_CENTS = np.array([0.29, 0.49, 0.79, 0.99])
+
+def retail_round_series(prices: pd.Series) -> pd.Series:
+    """Column-wise retail_round: searchsorted over the cent price points; NaN stays NaN."""
+    x = prices.to_numpy(dtype=np.float64, na_value=np.nan)
+    base = np.floor(x)
+    idx = np.searchsorted(_RETAIL_CENTS, (x - base) - 1e-9)
+    last = len(_RETAIL_CENTS) - 1
+    result = np.where(idx <= last, base + _RETAIL_CENTS[np.minimum(idx, last)], base + 1.29)
+    return pd.Series(np.round(result, 2), index=prices.index)
+
+# ========= Cost-unit mapping =========
+_PRICE_TYPE_MAP = {
+    "fixed": "each", "fix": "each", "fixed price": "each", "fixed_price": "each", "fixedprice": "each",
+    "per unit": "lb", "per_unit": "lb", "perunit": "lb",
+}
+
 # ========= Main transform =========
 def process_mapped_items(input_file: str) -> pd.DataFrame:
     p = Path(input_file)
     if not p.exists():
         raise FileNotFoundError(f"Input file not found: {input_file}")
-    df = pd.read_excel(input_file, dtype={"code": "string", "sku": "string"})
+    if p.suffix.lower() == ".parquet":
+        df = pd.read_parquet(input_file, engine="pyarrow")
+    else:
+        df = pd.read_excel(input_file, dtype={c: _STR_DTYPE for c in _STR_COLS})
     required = ["name","code","sku","price","priceType"]
     missing = [c for c in required if c not in df.columns]
     if missing:
         raise KeyError(f"Missing required columns: {missing}")
+    df = df.astype({c: _STR_DTYPE for c in _STR_COLS})
     name_col, code_col, sku_col, price_col, price_type_col = "name","code","sku","price","priceType"
-    df_f = df[~df[name_col].astype(str).str.contains(r'case|dozen', case=False, na=False)].copy()
-    code_blank = df_f[code_col].isna() | (df_f[code_col].astype(str).str.strip() == "")
-    sku_blank  = df_f[sku_col].isna()  | (df_f[sku_col].astype(str).str.strip() == "")
-    df_f = df_f[~(code_blank & sku_blank)].copy()
-    def _valid_row(r):
-        code_is_blank = pd.isna(r[code_col]) or str(r[code_col]).strip() == ""
-        return not (code_is_blank and normalize_numeric_token(r[sku_col]) is None)
-    df_f = df_f[df_f.apply(_valid_row, axis=1)].copy()
+    # strip code/sku once; the blank checks and the lookup-code parse below all reuse these
+    code_s = df[code_col].str.strip()
+    sku_s  = df[sku_col].str.strip()
+    code_blank = code_s.isna() | code_s.eq("")
+    sku_blank  = sku_s.isna()  | sku_s.eq("")
+    sku_ok = sku_s.str.fullmatch(_INT_OR_WHOLE_FLOAT.pattern).fillna(False).astype(bool)
+    # one composite filter, no intermediate copies (df_f is only read from below)
+    mask_case = ~df[name_col].str.contains(_CASE_DOZEN_RE.pattern, na=False)
+    mask_has_code_or_sku = ~(code_blank & sku_blank)
+    # drop rows with a blank code whose sku isn't a single whole number
+    mask_valid = ~(code_blank & ~sku_ok)
+    keep = mask_case & mask_has_code_or_sku & mask_valid
+    df_f, code_s, sku_s = df.loc[keep], code_s[keep], sku_s[keep]
     out = pd.DataFrame()
     base_price = pd.to_numeric(df_f[price_col], errors="coerce") * 1.13
-    out["cost_price_per_unit"] = base_price.apply(retail_round)
-    def map_cost_unit(x):
-        s = str(x).strip().lower()
-        if s in ("fixed","fix","fixed price","fixed_price","fixedprice"): return "each"
-        if s in ("per unit","per_unit","perunit"): return "lb"
-        return ""
-    out["cost_unit"] = df_f[price_type_col].apply(map_cost_unit)
-    out["lookup_code"] = df_f.apply(lambda r: get_lookup_code(r, code_col, sku_col), axis=1)
-    def _process_name(n):
-        cleaned,size,uom = extract_size_and_unit(n)
-        return pd.Series([cleaned,size,uom])
-    out[["name","size","size_uom"]] = df_f[name_col].apply(_process_name)
+    out["cost_price_per_unit"] = retail_round_series(base_price)
+    out["cost_unit"] = df_f[price_type_col].str.strip().str.lower().map(_PRICE_TYPE_MAP).fillna("")
+    out["lookup_code"] = pick_lookup_code(first_valid_numeric_series(code_s), first_valid_numeric_series(sku_s))
+    out[["name","size","size_uom"]] = extract_size_and_unit_series(df_f[name_col])
     out["unit_count"] = df_f["unit_count"] if "unit_count" in df_f.columns else None
     mask_pk = out["size_uom"].isin(["pk","pack"])
     to_fill = out.loc[mask_pk, "unit_count"].isna()
     out.loc[mask_pk & to_fill, "unit_count"] = out.loc[mask_pk & to_fill,"size"].round().astype("Int64")
     out.loc[mask_pk, "size"] = 1
     out["alcoholic"] = False
-    out = out[out["lookup_code"].astype(str).str.strip() != ""].copy()
-    work = out.copy()
-    work["_price_for_rank"] = pd.to_numeric(work["cost_price_per_unit"], errors="coerce").fillna(float("-inf"))
-    work["_rank"] = work.groupby("lookup_code")["_price_for_rank"].rank(method="first", ascending=False)
-    out = work[work["_rank"] == 1].drop(columns=["_price_for_rank","_rank"]).reset_index(drop=True)
+    out = out[out["lookup_code"] != ""]  # already stripped digits or ""
+    # keep the highest-priced row per lookup_code (earliest row on ties), in original row order
+    out = (out.assign(_p=pd.to_numeric(out["cost_price_per_unit"], errors="coerce").fillna(-np.inf))
+              .sort_values(["lookup_code","_p"], ascending=[True, False], kind="stable")
+              .drop_duplicates("lookup_code", keep="first")
+              .sort_index()
+              .drop(columns="_p")
+              .reset_index(drop=True))
     return out
 
 def save_outputs(df_out: pd.DataFrame, xlsx_path: str, csv_date_override: str | None = None) -> str:
-    with pd.ExcelWriter(xlsx_path, engine="xlsxwriter") as writer:
-        df_out.to_excel(writer, index=False, sheet_name="Sheet1")
-        workbook, worksheet = writer.book, writer.sheets["Sheet1"]
-        text_fmt = workbook.add_format({'num_format': '@'})
-        for idx, col in enumerate(df_out.columns):
-            if col == "lookup_code":
-                worksheet.set_column(idx, idx, 20, text_fmt)
-                break
+    if SAVE_XLSX:
+        with pd.ExcelWriter(xlsx_path, engine="xlsxwriter") as writer:
+            df_out.to_excel(writer, index=False, sheet_name="Sheet1")
+            workbook, worksheet = writer.book, writer.sheets["Sheet1"]
+            text_fmt = workbook.add_format({'num_format': '@'})
+            for idx, col in enumerate(df_out.columns):
+                if col == "lookup_code":
+                    worksheet.set_column(idx, idx, 20, text_fmt)
+                    break
+        print(f"✅ Wrote XLSX → {xlsx_path}")
     yyyymmdd = csv_date_override or datetime.now().strftime("%Y%m%d")
     csv_name = f"{yyyymmdd}_store_reinventory.csv"
-    df_csv = df_out.copy()
-    df_csv["lookup_code"] = df_csv["lookup_code"].astype(str).apply(lambda s: f'="{s}"')
-    df_csv.to_csv(csv_name, index=False, encoding="utf-8-sig")
-    print(f"✅ Wrote XLSX → {xlsx_path}")
+    # ="..." keeps Excel from reading codes as numbers (dropping leading zeros); one column-wise concat
+    df_csv = df_out.assign(lookup_code='="' + df_out["lookup_code"].astype(_STR_DTYPE).fillna("") + '"')
+    # arrow's native CSV writer; bools spelled True/False as before (arrow would write true/false)
+    df_csv = df_csv.astype({c: str for c in df_csv.columns[df_csv.dtypes == bool]})
+    table = pa.Table.from_pandas(df_csv, preserve_index=False)
+    with open(csv_name, "wb") as f:
+        f.write("\ufeff".encode("utf-8"))  # utf-8-sig BOM, as before
+        pa_csv.write_csv(table, f, write_options=pa_csv.WriteOptions(include_header=True))
     print(f"✅ Wrote CSV  → {csv_name}")
     return csv_name  # <-- needed by caller
 
-def upload_via_sftp(local_file: str):
+def upload_via_sftp(*local_files: str):
+    """Upload one or more files over a single SSH session (one handshake, zlib-compressed channel)."""
     # fail fast if env not set
     if not INSTACART_SFTP_HOST or not INSTACART_SFTP_USR or not INSTACART_SFTP_PASSWORD:
         raise RuntimeError("Missing one or more SFTP env vars: INSTACART_SFTP_HOST, INSTACART_SFTP_USR, INSTACART_SFTP_PASSWORD")
@@ -171,16 +198,15 @@ def upload_via_sftp(local_file: str):
     port = 22
     remote_dir = "/inventory-files/175949-spice_town-1"  # update if Instacart gave a different path
 
-    transport = paramiko.Transport((host, port))
-    transport.connect(username=username, password=password)
-    sftp = paramiko.SFTPClient.from_transport(transport)
-
-    remote_path = f"{remote_dir}/{Path(local_file).name}"
-    sftp.put(local_file, remote_path)
-    print(f"✅ Uploaded {local_file} → {remote_path}")
-
-    sftp.close()
-    transport.close()
+    with paramiko.Transport((host, port)) as transport:
+        transport.use_compression(True)   # must be set before connect(); CSV text compresses well
+        transport.set_keepalive(15)
+        transport.connect(username=username, password=password)
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            for local_file in local_files:
+                remote_path = f"{remote_dir}/{Path(local_file).name}"
+                sftp.put(local_file, remote_path)  # keeps the size-check stat after each put
+                print(f"✅ Uploaded {local_file} → {remote_path}")
 
 if __name__ == "__main__":
     final_df = process_mapped_items(INPUT_FILE)
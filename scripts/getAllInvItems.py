@@ -2,8 +2,12 @@
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Iterable, Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
 from openpyxl import Workbook
 
 # ========= Configuration =========
@@ -17,12 +21,19 @@ if not CLOVER_API_TOKEN or not CLOVER_MERCHANT_ID:
 
 # Tune these if needed
 DEFAULT_BATCH_SIZE = 1000  # Clover max
+_MAX_WORKERS_ENV = os.getenv("CLOVER_MAX_WORKERS", "4").strip()
+MAX_WORKERS = int(_MAX_WORKERS_ENV) if _MAX_WORKERS_ENV.isdecimal() else 0  # pages fetched concurrently; keep under Clover's per-token concurrency limit
+PARQUET_BATCH_ROWS = 10_000  # rows per Parquet record batch
 REQUEST_TIMEOUT_SEC = 30
 MAX_RETRIES = 5            # for 429/5xx
 RETRY_BASE_DELAY = 1.0     # seconds (exponential backoff)
 EXPAND = None              # e.g., "categories,tags,itemStock" (not required for selected fields)
 FILTER = None              # e.g., "deleted=false"
 
+if MAX_WORKERS < 1:
+    print(f"❌ CLOVER_MAX_WORKERS must be a positive integer (got {_MAX_WORKERS_ENV!r})", file=sys.stderr)
+    sys.exit(1)
+
 # ========= Utilities =========
 def _require_env(var_name: str) -> str:
     val = os.getenv(var_name)
@@ -38,12 +49,18 @@ def _headers() -> Dict[str, str]:
         "Content-Type": "application/json",
     }
 
+# Shared by the fetch threads in iter_all_items. The pool is at least MAX_WORKERS wide, so each
+# concurrent page request reuses a warm connection. Retries stay in _request_with_retries.
+_SESSION = requests.Session()
+_SESSION.headers.update(_headers())
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=max(16, MAX_WORKERS), max_retries=0))
+
 def _request_with_retries(method: str, url: str, *, params: Optional[Dict] = None) -> requests.Response:
     """Robust request with basic retry/backoff for 429/5xx."""
     attempt = 0
     while True:
         try:
-            resp = requests.request(method, url, headers=_headers(), params=params, timeout=REQUEST_TIMEOUT_SEC)
+            resp = _SESSION.request(method, url, params=params, timeout=REQUEST_TIMEOUT_SEC)
         except requests.RequestException as e:
             attempt += 1
             if attempt > MAX_RETRIES:
@@ -103,20 +120,39 @@ def get_items(*, offset: int, limit: int, expand: Optional[str] = EXPAND, filter
         items = data if isinstance(data, list) else []
     return items
 
-def iter_all_items(batch_size: int = DEFAULT_BATCH_SIZE) -> Iterable[Dict]:
-    """Generator that yields all items across pages."""
+def iter_all_items(batch_size: int = DEFAULT_BATCH_SIZE, max_workers: int = MAX_WORKERS) -> Iterable[Dict]:
+    """
+    Generator that yields all items across pages, in offset order.
+    Pages are requested max_workers at a time; the first short/empty page ends the scan.
+    """
+    def fetch(offset: int):
+        return get_items(offset=offset, limit=batch_size, expand=EXPAND, filters=FILTER)
+
     offset = 0
-    while True:
-        chunk = get_items(offset=offset, limit=batch_size, expand=EXPAND, filters=FILTER)
-        if not chunk:
-            break
-        # Stream out each item without holding the entire dataset in memory
-        yield from chunk
-        if len(chunk) < batch_size:
-            break
-        offset += batch_size
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            offsets = [offset + i * batch_size for i in range(max_workers)]
+            for chunk in pool.map(fetch, offsets):
+                if not chunk:
+                    return
+                # Stream out each item without holding the entire dataset in memory
+                yield from chunk
+                if len(chunk) < batch_size:
+                    return
+            offset = offsets[-1] + batch_size
 
 # ========= Flattening / Export =========
+# Parquet copy read by mapItems.py (the xlsx is kept for human inspection)
+ITEM_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("name", pa.string()),
+    ("code", pa.string()),
+    ("sku", pa.string()),
+    ("price", pa.int64()),      # cents
+    ("priceType", pa.string()),
+    ("cost", pa.int64()),       # cents
+])
+
 def flatten_item_min(item: Dict) -> Dict:
     """
     Extract only the required fields from a Clover item.
@@ -133,22 +169,44 @@ def flatten_item_min(item: Dict) -> Dict:
         "cost": item.get("cost"),
     }
 
-def export_items_to_excel_min(filepath: str, batch_size: int = DEFAULT_BATCH_SIZE):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Items"
+def export_items_to_excel_min(filepath: str, batch_size: int = DEFAULT_BATCH_SIZE, parquet_path: Optional[str] = None):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Items")
 
     headers = ["id", "name", "code", "sku", "price", "priceType", "cost"]
     ws.append(headers)
 
+    # Items stream to the write_only sheet and, PARQUET_BATCH_ROWS at a time, to a .tmp Parquet that
+    # replaces clover_items.parquet only after the whole scan succeeds (mapItems.py never sees a partial file).
+    tmp_path = f"{parquet_path}.tmp" if parquet_path else None
+    writer = pq.ParquetWriter(tmp_path, ITEM_SCHEMA, compression="zstd") if parquet_path else None
+    pending = []
     count = 0
-    for item in iter_all_items(batch_size=batch_size):
-        row = flatten_item_min(item)
-        ws.append([row.get(h) for h in headers])
-        count += 1
+    try:
+        for item in iter_all_items(batch_size=batch_size):
+            row = flatten_item_min(item)
+            ws.append([row.get(h) for h in headers])
+            count += 1
+            if writer is not None:
+                pending.append(row)
+                if len(pending) >= PARQUET_BATCH_ROWS:
+                    writer.write_batch(pa.RecordBatch.from_pylist(pending, schema=ITEM_SCHEMA))
+                    pending.clear()
+        if writer is not None and pending:
+            writer.write_batch(pa.RecordBatch.from_pylist(pending, schema=ITEM_SCHEMA))
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, parquet_path)
 
     wb.save(filepath)
     print(f"Wrote {count} items to {filepath}")
+    if parquet_path:
+        print(f"Wrote {count} items to {parquet_path}")
 
 # ========= Main =========
 if __name__ == "__main__":
@@ -158,4 +216,4 @@ if __name__ == "__main__":
     # FILTER = "deleted=false"
 
     out_path = "clover_items.xlsx"
-    export_items_to_excel_min(out_path, batch_size=DEFAULT_BATCH_SIZE)
+    export_items_to_excel_min(out_path, batch_size=DEFAULT_BATCH_SIZE, parquet_path="clover_items.parquet")
